@@ -5,15 +5,39 @@ Servidor principal de AutoScan IA - Versión Profesional
 import os
 import logging
 import sys
+import time
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+import orjson
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import BaseTarget
+from werkzeug.exceptions import RequestEntityTooLarge
+from whitenoise import WhiteNoise
 from backend.damage_analyzer import DamageAnalyzer
 from backend.auth import auth_bp
 from flask_cors import CORS
 
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+class ORJSONProvider(JSONProvider):
+    """Proveedor JSON de Flask basado en orjson (jsonify y request.get_json)"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=ORJSON_OPTIONS),
+                                        mimetype='application/json')
+
 # Configuración
 app = Flask(__name__, static_folder='frontend', static_url_path='')
+app.json = ORJSONProvider(app)
 CORS(app, 
      resources={
          r"/api/*": {
@@ -43,53 +67,126 @@ except Exception as e:
     analyzer = None
 
 # Configuración
-UPLOAD_FOLDER = 'backend/temp_uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Firmas (magic bytes) de JPEG, PNG y WebP; el content_type del cliente no es fiable
+IMAGE_HEAD_SIZE = 12
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n')
+
+def is_image(head):
+    """Comprobar si los primeros bytes corresponden a una imagen soportada"""
+    return head.startswith(IMAGE_SIGNATURES) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+class ImageTarget(BaseTarget):
+    """Target en memoria (como ValueTarget) que valida la firma de imagen con
+    los primeros bytes y descarta el resto de la parte si no es una imagen"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_image = None
+        self._head = b''
+        self._chunks = []
+
+    def on_data_received(self, chunk):
+        if self.is_image is None:
+            self._head += chunk[:IMAGE_HEAD_SIZE - len(self._head)]
+            if len(self._head) == IMAGE_HEAD_SIZE:
+                self.is_image = is_image(self._head)
+                if not self.is_image:
+                    self._chunks.clear()
+        if self.is_image is not False:
+            self._chunks.append(chunk)
 
-# Servir archivos estáticos del frontend
-@app.route('/')
-def serve_index():
-    return send_from_directory(app.static_folder, 'index.html')
+    async def on_data_received_async(self, chunk):
+        self.on_data_received(chunk)
 
-@app.route('/<path:path>')
-def serve_static(path):
-    return send_from_directory(app.static_folder, path)
+    @property
+    def value(self):
+        return b''.join(self._chunks)
+
+    def on_finish(self):
+        if self.is_image is None:
+            self.is_image = is_image(self._head)
+
+# Timestamp ISO de las respuestas, recalculado como máximo una vez por segundo
+_iso_cache = (0, '')
+
+def now_iso():
+    """Devolver el timestamp ISO del segundo actual"""
+    global _iso_cache
+    second = int(time.time())
+    if _iso_cache[0] != second:
+        _iso_cache = (second, datetime.fromtimestamp(second).isoformat())
+    return _iso_cache[1]
+
+# Respuestas de health/stats (sondas del balanceador) cacheadas durante 1 segundo
+RESPONSE_CACHE_TTL = 1.0
+_response_cache = {}
+
+def cached_json_response(key, build):
+    """Devolver el JSON cacheado para key, reconstruyéndolo con build() al expirar"""
+    now = time.monotonic()
+    cached = _response_cache.get(key)
+    if cached is None or now - cached[0] > RESPONSE_CACHE_TTL:
+        cached = (now, orjson.dumps(build(), option=ORJSON_OPTIONS))
+        _response_cache[key] = cached
+    return Response(cached[1], mimetype='application/json')
+
+# Servir archivos estáticos del frontend con WhiteNoise (ETag/304 y caché en memoria).
+# Los assets no llevan hash en el nombre, así que el max-age por defecto es corto.
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_MAX_AGE
+app.wsgi_app = WhiteNoise(
+    app.wsgi_app,
+    root=app.static_folder,
+    max_age=STATIC_MAX_AGE,
+    index_file=True,
+    autorefresh=False
+)
 
 # API Routes
+# JSON del índice de la API por URL base (la URL base es estable por despliegue;
+# el límite evita que cabeceras Host arbitrarias hagan crecer la caché)
+API_INDEX_CACHE_SIZE = 16
+_api_index_cache = {}
+
 @app.route('/api/')
 def api_index():
     """Endpoint principal de la API - Documentación"""
     base_url = request.url_root.rstrip('/')
     
-    endpoints = {
-        "service": "AutoScan IA API",
-        "version": "1.0.0",
-        "status": "online",
-        "endpoints": {
-            "health": f"{base_url}/api/health",
-            "analyze": f"{base_url}/api/analyze",
-            "stats": f"{base_url}/api/stats",
-            "auth_register": f"{base_url}/api/auth/register",
-            "auth_login": f"{base_url}/api/auth/login",
-            "auth_verify": f"{base_url}/api/auth/verify",
-            "auth_logout": f"{base_url}/api/auth/logout"
-        },
-        "description": "API profesional para análisis de daños vehiculares con IA",
-        "documentation": "Visita / para la interfaz web completa"
-    }
+    body = _api_index_cache.get(base_url)
+    if body is None:
+        endpoints = {
+            "service": "AutoScan IA API",
+            "version": "1.0.0",
+            "status": "online",
+            "endpoints": {
+                "health": f"{base_url}/api/health",
+                "analyze": f"{base_url}/api/analyze",
+                "stats": f"{base_url}/api/stats",
+                "auth_register": f"{base_url}/api/auth/register",
+                "auth_login": f"{base_url}/api/auth/login",
+                "auth_verify": f"{base_url}/api/auth/verify",
+                "auth_logout": f"{base_url}/api/auth/logout"
+            },
+            "description": "API profesional para análisis de daños vehiculares con IA",
+            "documentation": "Visita / para la interfaz web completa"
+        }
+        body = orjson.dumps(endpoints, option=ORJSON_OPTIONS)
+        if len(_api_index_cache) >= API_INDEX_CACHE_SIZE:
+            _api_index_cache.clear()
+        _api_index_cache[base_url] = body
     
-    return jsonify(endpoints)
+    return Response(body, mimetype='application/json')
 
 @app.route('/api/health')
 def health_check():
     """Health check del servicio"""
-    ia_status = "healthy" if analyzer and analyzer.model_loaded else "unavailable"
-    return jsonify({
+    return cached_json_response('health', lambda: {
         "status": "healthy",
-        "ia_status": ia_status,
-        "timestamp": datetime.now().isoformat()
+        "ia_status": "healthy" if analyzer and analyzer.model_loaded else "unavailable",
+        "timestamp": now_iso()
     })
 
 @app.route('/api/analyze', methods=['POST'])
@@ -103,75 +200,83 @@ def analyze_vehicle():
             "status": "error"
         }), 503
 
+    # Rechazar cuerpos demasiado grandes antes de leer el stream
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        return too_large(None)
+
+    if request.mimetype != 'multipart/form-data':
+        return jsonify({
+            "error": "La petición debe enviarse como multipart/form-data",
+            "status": "error"
+        }), 400
+
+    required_angles = ['frontal', 'lateral-derecho', 'lateral-izquierdo', 'trasero']
+
     try:
+        # Parsear el multipart en streaming: cada parte se acumula en memoria
+        # y se entrega al analizador sin pasar por disco ni por request.files
+        try:
+            parser = StreamingFormDataParser(headers={'Content-Type': request.content_type or ''})
+            targets = {}
+            for angle in required_angles:
+                targets[angle] = ImageTarget()
+                parser.register(angle, targets[angle])
+
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                parser.data_received(chunk)
+        except ParseFailedException:
+            return jsonify({
+                "error": "Formulario multipart inválido",
+                "status": "error"
+            }), 400
+        except RequestEntityTooLarge:
+            # Subidas chunked sin Content-Length: el límite salta durante la lectura
+            return too_large(None)
+
         # Verificar imágenes
-        required_angles = ['frontal', 'lateral-derecho', 'lateral-izquierdo', 'trasero']
-        image_files = {}
-        
         for angle in required_angles:
-            if angle not in request.files:
+            target = targets[angle]
+            if target.multipart_filename is None:
                 return jsonify({
                     "error": f"Falta imagen: {angle}",
                     "status": "error"
                 }), 400
-            
-            file = request.files[angle]
-            if file.filename == '':
+
+            if target.multipart_filename == '':
                 return jsonify({
                     "error": f"Archivo vacío: {angle}",
                     "status": "error"
                 }), 400
-            
-            # Validar tipo de archivo
-            if not file.content_type.startswith('image/'):
+
+            # Validar tipo de archivo por su firma, no por el content_type
+            if not target.is_image:
                 return jsonify({
                     "error": f"Archivo no es imagen: {angle}",
                     "status": "error"
                 }), 400
-            
-            image_files[angle] = file
 
-        logger.info(f"📨 Análisis solicitado con {len(image_files)} imágenes")
+        logger.info(f"📨 Análisis solicitado con {len(targets)} imágenes")
 
-        # Guardar imágenes temporalmente
-        saved_paths = {}
-        for angle, file in image_files.items():
-            filename = f"{angle}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            saved_paths[angle] = filepath
+        images = {angle: target.value for angle, target in targets.items()}
 
         # Procesar con IA
         logger.info("🔮 Procesando imágenes con IA...")
-        results = analyzer.analyze_vehicle(saved_paths)
-        
-        # Limpiar archivos temporales
-        for filepath in saved_paths.values():
-            try:
-                os.remove(filepath)
-            except Exception as e:
-                logger.warning(f"No se pudo eliminar {filepath}: {e}")
+        results = analyzer.analyze_vehicle_bytes(images)
 
         logger.info("✅ Análisis completado exitosamente")
         
         return jsonify({
             "status": "success",
             "results": results,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         })
 
     except Exception as e:
         logger.error(f"❌ Error en análisis: {str(e)}")
         
-        # Limpiar archivos en caso de error
-        if 'saved_paths' in locals():
-            for filepath in saved_paths.values():
-                try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                except:
-                    pass
-        
         return jsonify({
             "error": f"Error procesando las imágenes: {str(e)}",
             "status": "error"
@@ -180,12 +285,12 @@ def analyze_vehicle():
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Endpoint para obtener estadísticas del servicio"""
-    return jsonify({
+    return cached_json_response('stats', lambda: {
         "status": "online",
         "service": "AutoScan IA",
         "version": "1.0.0",
         "model_loaded": analyzer.model_loaded if analyzer else False,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": now_iso()
     })
 
 # Error handlers
@@ -211,7 +316,7 @@ def internal_error(e):
     }), 500
 
 if __name__ == '__main__':
-    # Configuración para producción
+    # Servidor de desarrollo; en producción se sirve con gunicorn (ver Procfile y wsgi.py)
     port = int(os.environ.get('PORT', 10000))
     host = os.environ.get('HOST', '0.0.0.0')
     
@@ -221,5 +326,6 @@ if __name__ == '__main__':
     app.run(
         host=host,
         port=port,
-        debug=False
+        debug=False,
+        threaded=True
     )
\ No newline at end of file
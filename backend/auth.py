@@ -2,14 +2,28 @@
 Sistema de autenticación para AutoScan IA con verificación de email
 """
 import os
+import re
+import base64
+import binascii
 import sqlite3
 import hashlib
+import hmac
+import html
 import secrets
 import smtplib
+import string
+import threading
+import time
+import types
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, current_app
+from dotenv import load_dotenv
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,135 +32,371 @@ logger = logging.getLogger(__name__)
 auth_bp = Blueprint('auth', __name__)
 DATABASE = 'backend/users.db'
 
-# Configuración de email - USAR VARIABLES DE ENTORNO EN PRODUCCIÓN
-EMAIL_CONFIG = {
-    'smtp_server': 'smtp.gmail.com',
-    'smtp_port': 587,
-    'sender_email': os.environ.get('EMAIL_SENDER', 'scriptluisch@gmail.com'),
-    'sender_password': os.environ.get('EMAIL_PASSWORD', 'czgbxznprzxbigad'),
-    'app_url': os.environ.get('APP_URL', 'https://autoscan-ia.onrender.com')
-}
+# Validación de email antes de tocar la base de datos o el SMTP
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[a-zA-Z]{2,}$")
 
-def init_db():
-    """Inicializar base de datos de usuarios con manejo de actualizaciones"""
-    os.makedirs('backend', exist_ok=True)
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Crear tabla users si no existe
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            plan TEXT DEFAULT 'basic',
-            analyses_count INTEGER DEFAULT 0,
-            email_verified BOOLEAN DEFAULT FALSE,
-            verification_token TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_sessions (
-            session_id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Verificar y agregar columnas faltantes
+# Hasher de contraseñas (parámetros mínimos recomendados por OWASP para Argon2id)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+def require_env(name):
+    """Leer una variable de entorno obligatoria, fallando al importar si falta"""
+    value = os.environ.get(name)
+    if not value:
+        raise RuntimeError(f"Falta la variable de entorno obligatoria {name}")
+    return value
+
+# Configuración de email - las credenciales solo se leen del entorno (o de .env)
+load_dotenv()
+EMAIL_CONFIG = types.SimpleNamespace(
+    smtp_server=os.environ.get('EMAIL_SMTP', 'smtp.gmail.com'),
+    smtp_port=int(os.environ.get('EMAIL_PORT', 587)),
+    sender_email=require_env('EMAIL_SENDER'),
+    sender_password=require_env('EMAIL_PASSWORD'),
+    app_url=os.environ.get('APP_URL', 'https://autoscan-ia.onrender.com')
+)
+
+# Plantillas HTML (se sustituyen con string.Template en cada uso)
+VERIFY_EMAIL_HTML = string.Template("""\
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: #3b82f6; color: white; padding: 20px; text-align: center; }
+        .content { padding: 20px; background: #f9fafb; }
+        .button { display: inline-block; padding: 12px 24px; background: #3b82f6; color: white; 
+                 text-decoration: none; border-radius: 5px; margin: 20px 0; }
+        .footer { text-align: center; padding: 20px; color: #6b7280; font-size: 14px; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>AutoScan IA</h1>
+            <p>Verificación de Cuenta</p>
+        </div>
+        <div class="content">
+            <h2>Hola $first_name,</h2>
+            <p>Gracias por registrarte en AutoScan IA. Para activar tu cuenta, por favor verifica tu dirección de email.</p>
+
+            <div style="text-align: center;">
+                <a href="$verification_url" class="button">Verificar Mi Email</a>
+            </div>
+
+            <p>Si el botón no funciona, copia y pega este enlace en tu navegador:</p>
+            <p style="word-break: break-all; background: #e5e7eb; padding: 10px; border-radius: 5px;">
+                $verification_url
+            </p>
+
+            <p><strong>Este enlace expirará en 24 horas.</strong></p>
+
+            <p>Si no te registraste en AutoScan IA, puedes ignorar este mensaje.</p>
+        </div>
+        <div class="footer">
+            <p>&copy; 2025 AutoScan IA. Todos los derechos reservados.</p>
+        </div>
+    </div>
+</body>
+</html>
+""")
+
+VERIFY_ERROR_HTML = """\
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Error de Verificación - AutoScan IA</title>
+    <style>
+        body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
+        .error { color: #ef4444; font-size: 24px; margin: 20px 0; }
+        .button { display: inline-block; padding: 12px 24px; background: #3b82f6; 
+                 color: white; text-decoration: none; border-radius: 5px; margin: 20px; }
+    </style>
+</head>
+<body>
+    <div class="error">❌ Enlace inválido o expirado</div>
+    <p>El enlace de verificación no es válido o ya ha sido utilizado.</p>
+    <a href="/login.html" class="button">Ir al Login</a>
+</body>
+</html>
+"""
+
+VERIFY_SUCCESS_HTML = string.Template("""\
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Email Verificado - AutoScan IA</title>
+    <style>
+        body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
+        .success { color: #10b981; font-size: 24px; margin: 20px 0; }
+        .button { display: inline-block; padding: 12px 24px; background: #3b82f6; 
+                 color: white; text-decoration: none; border-radius: 5px; margin: 10px; }
+        .info { color: #6b7280; margin: 20px 0; }
+    </style>
+</head>
+<body>
+    <div class="success">✅ ¡Email verificado exitosamente!</div>
+    <p>Hola <strong>$first_name</strong>, tu cuenta ha sido activada correctamente.</p>
+
+    <div class="info">
+        <p>Ahora puedes iniciar sesión con tu email y contraseña.</p>
+    </div>
+
+    <div>
+        <a href="/login.html" class="button">Iniciar Sesión</a>
+        <a href="/" class="button" style="background: #6b7280;">Ir al Inicio</a>
+    </div>
+</body>
+</html>
+""")
+
+# Consultas del hot path; el texto fijo permite que cada conexión
+# reutilice la sentencia preparada desde su caché de statements
+SQL_SELECT_USER_ID_BY_EMAIL = "SELECT id FROM users WHERE email = ?"
+
+SQL_INSERT_USER = """
+    INSERT INTO users (email, password_hash, first_name, last_name, verification_token)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+SQL_SELECT_USER_BY_TOKEN = """
+    SELECT id, email, first_name FROM users
+    WHERE verification_token = ? AND email_verified = FALSE
+"""
+
+SQL_MARK_EMAIL_VERIFIED = """
+    UPDATE users
+    SET email_verified = TRUE, verification_token = NULL
+    WHERE id = ?
+"""
+
+SQL_SELECT_USER_BY_EMAIL = """
+    SELECT id, email, password_hash, first_name, last_name, plan, analyses_count, email_verified
+    FROM users WHERE email = ?
+"""
+
+SQL_UPDATE_PASSWORD_HASH = "UPDATE users SET password_hash = ? WHERE id = ?"
+
+SQL_INSERT_SESSION = "INSERT INTO user_sessions (session_id, user_id) VALUES (?, ?)"
+
+SQL_SELECT_SESSION_USER = """
+    SELECT u.id, u.email, u.first_name, u.last_name, u.plan, u.analyses_count, u.email_verified
+    FROM users u
+    JOIN user_sessions s ON u.id = s.user_id
+    WHERE s.session_id = ? AND s.created_at > datetime('now', '-7 days')
+"""
+
+SQL_DELETE_SESSION = "DELETE FROM user_sessions WHERE session_id = ?"
+
+SQL_DELETE_EXPIRED_SESSIONS = "DELETE FROM user_sessions WHERE created_at < datetime('now', '-30 days')"
+
+# Intervalo de la limpieza de sesiones expiradas (segundos)
+SESSION_CLEANUP_INTERVAL = int(os.environ.get('SESSION_CLEANUP_INTERVAL', 300))
+
+# Conexiones SQLite reutilizadas por hilo (una por worker thread)
+_local = threading.local()
+
+def get_conn():
+    """Obtener la conexión SQLite del hilo actual, abriéndola si no existe"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE, check_same_thread=False, isolation_level=None,
+                               cached_statements=256)
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+        """)
+        _local.conn = conn
+    return conn
+
+# Esquema completo; PRAGMA user_version marca la versión aplicada.
+# Se ejecuta sentencia a sentencia dentro de la transacción de init_db
+# (executescript haría COMMIT de la transacción abierta)
+SCHEMA_VERSION = 3
+
+SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    plan TEXT DEFAULT 'basic',
+    analyses_count INTEGER DEFAULT 0,
+    email_verified BOOLEAN DEFAULT FALSE,
+    verification_token TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_sessions (
+    session_id BLOB PRIMARY KEY,
+    user_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+-- Índices para la verificación de email y la limpieza de sesiones
+CREATE INDEX IF NOT EXISTS idx_users_token
+    ON users(verification_token) WHERE verification_token IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_sessions_created ON user_sessions(created_at);
+
+-- Las sesiones en hexadecimal (esquema < 3) ya no son válidas
+DELETE FROM user_sessions WHERE typeof(session_id) = 'text';
+
+ANALYZE;
+PRAGMA user_version = {SCHEMA_VERSION}
+"""
+
+@contextmanager
+def write_transaction():
+    """Agrupar varias escrituras en una transacción BEGIN IMMEDIATE ... COMMIT"""
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cursor.fetchall()]
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def migrate_legacy_users(conn):
+    """Agregar columnas faltantes en tablas users creadas antes de la verificación de email"""
+    try:
+        columns = [column[1] for column in conn.execute("PRAGMA table_info(users)")]
+        if not columns:
+            return
         
         if 'email_verified' not in columns:
-            cursor.execute("ALTER TABLE users ADD COLUMN email_verified BOOLEAN DEFAULT FALSE")
+            conn.execute("ALTER TABLE users ADD COLUMN email_verified BOOLEAN DEFAULT FALSE")
             logger.info("✅ Columna 'email_verified' agregada")
         
         if 'verification_token' not in columns:
-            cursor.execute("ALTER TABLE users ADD COLUMN verification_token TEXT")
+            conn.execute("ALTER TABLE users ADD COLUMN verification_token TEXT")
             logger.info("✅ Columna 'verification_token' agregada")
             
         # Marcar usuarios existentes como verificados
-        cursor.execute("UPDATE users SET email_verified = TRUE WHERE email_verified IS NULL")
+        conn.execute("UPDATE users SET email_verified = TRUE WHERE email_verified IS NULL")
         
     except Exception as e:
         logger.warning(f"⚠️ Error verificando estructura de tabla: {e}")
+
+def init_db():
+    """Inicializar base de datos de usuarios con manejo de actualizaciones"""
+    os.makedirs('backend', exist_ok=True)
+    conn = get_conn()
     
-    conn.commit()
-    conn.close()
-    logger.info("✅ Base de datos inicializada/actualizada")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    
+    # Los workers de gunicorn inicializan a la vez: BEGIN IMMEDIATE serializa la
+    # actualización y quien pierde la carrera ve la versión nueva tras el lock
+    with write_transaction() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        
+        migrate_legacy_users(conn)
+        for statement in SCHEMA_SQL.split(';'):
+            conn.execute(statement)
+    logger.info(f"✅ Base de datos inicializada/actualizada (esquema v{SCHEMA_VERSION})")
+
+def encode_session_id(session_id):
+    """Codificar el session_id binario para el JSON (base64 url-safe sin padding)"""
+    return base64.urlsafe_b64encode(session_id).rstrip(b'=').decode('ascii')
+
+def decode_session_id(token):
+    """Decodificar el session_id recibido del cliente; None si no es válido"""
+    if not isinstance(token, str):
+        return None
+    try:
+        return base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (binascii.Error, ValueError):
+        return None
 
 def hash_password(password):
-    """Hashear contraseña"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hashear contraseña con Argon2id"""
+    return password_hasher.hash(password)
+
+def verify_password(password, stored_hash):
+    """Verificar contraseña contra un hash Argon2 o un SHA-256 heredado"""
+    if not stored_hash.startswith('$argon2'):
+        # Hash SHA-256 en hexadecimal de cuentas anteriores a Argon2
+        legacy_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return hmac.compare_digest(legacy_hash, stored_hash)
+    
+    try:
+        return password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def password_needs_rehash(stored_hash):
+    """Indica si el hash debe regenerarse con los parámetros actuales"""
+    if not stored_hash.startswith('$argon2'):
+        return True
+    return password_hasher.check_needs_rehash(stored_hash)
+
+# Envío de emails fuera del hilo de la petición
+email_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='mailer')
+
+# Conexiones SMTP persistentes por hilo del executor
+_smtp_local = threading.local()
+
+def get_smtp():
+    """Obtener la conexión SMTP del hilo actual, reconectando si se cayó"""
+    server = getattr(_smtp_local, 'server', None)
+    if server is not None:
+        try:
+            if server.noop()[0] == 250:
+                return server
+        except (smtplib.SMTPException, OSError):
+            pass
+        close_smtp()
+    
+    server = smtplib.SMTP(EMAIL_CONFIG.smtp_server, EMAIL_CONFIG.smtp_port)
+    server.starttls()
+    server.login(EMAIL_CONFIG.sender_email, EMAIL_CONFIG.sender_password)
+    _smtp_local.server = server
+    return server
+
+def close_smtp():
+    """Cerrar la conexión SMTP del hilo actual"""
+    server = getattr(_smtp_local, 'server', None)
+    _smtp_local.server = None
+    if server is None:
+        return
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
 
 def send_verification_email(user_email, first_name, verification_token):
     """Enviar email de verificación"""
     try:
         subject = "Verifica tu cuenta - AutoScan IA"
         
-        verification_url = f"{EMAIL_CONFIG['app_url']}/api/auth/verify-email?token={verification_token}"
-        
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: #3b82f6; color: white; padding: 20px; text-align: center; }}
-                .content {{ padding: 20px; background: #f9fafb; }}
-                .button {{ display: inline-block; padding: 12px 24px; background: #3b82f6; color: white; 
-                         text-decoration: none; border-radius: 5px; margin: 20px 0; }}
-                .footer {{ text-align: center; padding: 20px; color: #6b7280; font-size: 14px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>AutoScan IA</h1>
-                    <p>Verificación de Cuenta</p>
-                </div>
-                <div class="content">
-                    <h2>Hola {first_name},</h2>
-                    <p>Gracias por registrarte en AutoScan IA. Para activar tu cuenta, por favor verifica tu dirección de email.</p>
-                    
-                    <div style="text-align: center;">
-                        <a href="{verification_url}" class="button">Verificar Mi Email</a>
-                    </div>
-                    
-                    <p>Si el botón no funciona, copia y pega este enlace en tu navegador:</p>
-                    <p style="word-break: break-all; background: #e5e7eb; padding: 10px; border-radius: 5px;">
-                        {verification_url}
-                    </p>
-                    
-                    <p><strong>Este enlace expirará en 24 horas.</strong></p>
-                    
-                    <p>Si no te registraste en AutoScan IA, puedes ignorar este mensaje.</p>
-                </div>
-                <div class="footer">
-                    <p>&copy; 2025 AutoScan IA. Todos los derechos reservados.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        verification_url = f"{EMAIL_CONFIG.app_url}/api/auth/verify-email?token={verification_token}"
+        
+        html_content = VERIFY_EMAIL_HTML.substitute(
+            first_name=html.escape(first_name),
+            verification_url=verification_url
+        )
         
         msg = MIMEMultipart()
-        msg['From'] = EMAIL_CONFIG['sender_email']
+        msg['From'] = EMAIL_CONFIG.sender_email
         msg['To'] = user_email
         msg['Subject'] = subject
         msg.attach(MIMEText(html_content, 'html'))
         
-        with smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port']) as server:
-            server.starttls()
-            server.login(EMAIL_CONFIG['sender_email'], EMAIL_CONFIG['sender_password'])
-            server.send_message(msg)
+        try:
+            get_smtp().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # El servidor cerró la conexión entre el NOOP y el envío: reintentar una vez
+            close_smtp()
+            get_smtp().send_message(msg)
         
         logger.info(f"✅ Email de verificación enviado a {user_email}")
         return True
@@ -172,34 +422,25 @@ def register():
         if len(password) < 6:
             return jsonify({"error": "La contraseña debe tener al menos 6 caracteres"}), 400
         
-        if '@' not in email:
+        if not EMAIL_RE.match(email):
             return jsonify({"error": "Email inválido"}), 400
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        cursor = get_conn().cursor()
         
-        cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
+        cursor.execute(SQL_SELECT_USER_ID_BY_EMAIL, (email,))
         if cursor.fetchone():
-            conn.close()
             return jsonify({"error": "El email ya está registrado"}), 400
         
         password_hash = hash_password(password)
         verification_token = secrets.token_urlsafe(32)
         
-        cursor.execute('''
-            INSERT INTO users (email, password_hash, first_name, last_name, verification_token)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (email, password_hash, first_name, last_name, verification_token))
+        cursor.execute(SQL_INSERT_USER, (email, password_hash, first_name, last_name, verification_token))
         
         user_id = cursor.lastrowid
         
-        email_sent = send_verification_email(email, first_name, verification_token)
-        
-        if not email_sent:
-            logger.warning(f"⚠️ Usuario {email} registrado pero email no enviado")
-        
-        conn.commit()
-        conn.close()
+        # El email se envía en segundo plano; los fallos quedan en el log del mailer
+        email_executor.submit(send_verification_email, email, first_name, verification_token)
+        email_sent = True
         
         return jsonify({
             "success": True,
@@ -225,100 +466,23 @@ def verify_email():
         token = request.args.get('token')
         
         if not token:
-            error_html = """
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Error de Verificación - AutoScan IA</title>
-                <style>
-                    body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
-                    .error { color: #ef4444; font-size: 24px; margin: 20px 0; }
-                    .button { display: inline-block; padding: 12px 24px; background: #3b82f6; 
-                             color: white; text-decoration: none; border-radius: 5px; margin: 20px; }
-                </style>
-            </head>
-            <body>
-                <div class="error">❌ Enlace inválido o expirado</div>
-                <p>El enlace de verificación no es válido o ya ha sido utilizado.</p>
-                <a href="/login.html" class="button">Ir al Login</a>
-            </body>
-            </html>
-            """
-            return error_html, 400
-        
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, email, first_name FROM users 
-            WHERE verification_token = ? AND email_verified = FALSE
-        ''', (token,))
+            return VERIFY_ERROR_HTML, 400
+        
+        cursor = get_conn().cursor()
+        
+        cursor.execute(SQL_SELECT_USER_BY_TOKEN, (token,))
         
         user = cursor.fetchone()
         
         if not user:
-            conn.close()
-            error_html = """
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Error de Verificación - AutoScan IA</title>
-                <style>
-                    body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
-                    .error { color: #ef4444; font-size: 24px; margin: 20px 0; }
-                    .button { display: inline-block; padding: 12px 24px; background: #3b82f6; 
-                             color: white; text-decoration: none; border-radius: 5px; margin: 20px; }
-                </style>
-            </head>
-            <body>
-                <div class="error">❌ Enlace inválido o expirado</div>
-                <p>El enlace de verificación no es válido o ya ha sido utilizado.</p>
-                <a href="/login.html" class="button">Ir al Login</a>
-            </body>
-            </html>
-            """
-            return error_html, 400
+            return VERIFY_ERROR_HTML, 400
         
         user_id, user_email, first_name = user
         
-        cursor.execute('''
-            UPDATE users 
-            SET email_verified = TRUE, verification_token = NULL 
-            WHERE id = ?
-        ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        cursor.execute(SQL_MARK_EMAIL_VERIFIED, (user_id,))
         
         # ✅ CORRECCIÓN: Página de éxito SIN redirección automática al dashboard
-        success_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Email Verificado - AutoScan IA</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; text-align: center; padding: 50px; }}
-                .success {{ color: #10b981; font-size: 24px; margin: 20px 0; }}
-                .button {{ display: inline-block; padding: 12px 24px; background: #3b82f6; 
-                         color: white; text-decoration: none; border-radius: 5px; margin: 10px; }}
-                .info {{ color: #6b7280; margin: 20px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="success">✅ ¡Email verificado exitosamente!</div>
-            <p>Hola <strong>{first_name}</strong>, tu cuenta ha sido activada correctamente.</p>
-            
-            <div class="info">
-                <p>Ahora puedes iniciar sesión con tu email y contraseña.</p>
-            </div>
-            
-            <div>
-                <a href="/login.html" class="button">Iniciar Sesión</a>
-                <a href="/" class="button" style="background: #6b7280;">Ir al Inicio</a>
-            </div>
-        </body>
-        </html>
-        """
+        success_html = VERIFY_SUCCESS_HTML.substitute(first_name=html.escape(first_name))
         
         return success_html, 200
         
@@ -337,48 +501,37 @@ def login():
         email = data['email'].lower().strip()
         password = data['password']
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        cursor = get_conn().cursor()
         
-        cursor.execute('''
-            SELECT id, email, password_hash, first_name, last_name, plan, analyses_count, email_verified 
-            FROM users WHERE email = ?
-        ''', (email,))
+        cursor.execute(SQL_SELECT_USER_BY_EMAIL, (email,))
         
         user = cursor.fetchone()
         
         if not user:
-            conn.close()
             return jsonify({"error": "Credenciales incorrectas"}), 401
         
         user_id, user_email, stored_hash, first_name, last_name, plan, analyses_count, email_verified = user
         
-        if hash_password(password) != stored_hash:
-            conn.close()
+        if not verify_password(password, stored_hash):
             return jsonify({"error": "Credenciales incorrectas"}), 401
         
         if not email_verified:
-            conn.close()
             return jsonify({"error": "Por favor verifica tu email antes de iniciar sesión"}), 401
         
-        session_id = secrets.token_hex(32)
-        cursor.execute('''
-            INSERT INTO user_sessions (session_id, user_id)
-            VALUES (?, ?)
-        ''', (session_id, user_id))
-        
-        cursor.execute('''
-            DELETE FROM user_sessions 
-            WHERE created_at < datetime('now', '-30 days')
-        ''')
+        # Migrar hashes heredados a Argon2 tras un login correcto (se calcula
+        # fuera de la transacción para no retener el lock de escritura)
+        new_hash = hash_password(password) if password_needs_rehash(stored_hash) else None
         
-        conn.commit()
-        conn.close()
+        session_id = secrets.token_bytes(32)
+        with write_transaction() as conn:
+            if new_hash:
+                conn.execute(SQL_UPDATE_PASSWORD_HASH, (new_hash, user_id))
+            conn.execute(SQL_INSERT_SESSION, (session_id, user_id))
         
         return jsonify({
             "success": True,
             "message": "Sesión iniciada exitosamente",
-            "session_id": session_id,
+            "session_id": encode_session_id(session_id),
             "user": {
                 "id": user_id,
                 "email": user_email,
@@ -402,20 +555,15 @@ def verify_session():
         if not data or 'session_id' not in data:
             return jsonify({"error": "Sesión requerida"}), 401
         
-        session_id = data['session_id']
+        session_id = decode_session_id(data['session_id'])
+        if session_id is None:
+            return jsonify({"error": "Sesión inválida o expirada"}), 401
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        cursor = get_conn().cursor()
         
-        cursor.execute('''
-            SELECT u.id, u.email, u.first_name, u.last_name, u.plan, u.analyses_count, u.email_verified
-            FROM users u
-            JOIN user_sessions s ON u.id = s.user_id
-            WHERE s.session_id = ? AND s.created_at > datetime('now', '-7 days')
-        ''', (session_id,))
+        cursor.execute(SQL_SELECT_SESSION_USER, (session_id,))
         
         user = cursor.fetchone()
-        conn.close()
         
         if not user:
             return jsonify({"error": "Sesión inválida o expirada"}), 401
@@ -445,18 +593,30 @@ def logout():
         data = request.get_json()
         
         if data and 'session_id' in data:
-            session_id = data['session_id']
+            session_id = decode_session_id(data['session_id'])
             
-            conn = sqlite3.connect(DATABASE)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM user_sessions WHERE session_id = ?", (session_id,))
-            conn.commit()
-            conn.close()
+            if session_id is not None:
+                cursor = get_conn().cursor()
+                cursor.execute(SQL_DELETE_SESSION, (session_id,))
         
         return jsonify({"success": True, "message": "Sesión cerrada"})
         
     except Exception as e:
         return jsonify({"error": f"Error cerrando sesión: {str(e)}"}), 500
 
-# Inicializar base de datos al importar
-init_db()
\ No newline at end of file
+def cleanup_expired_sessions():
+    """Eliminar periódicamente las sesiones expiradas (hilo en segundo plano)"""
+    while True:
+        time.sleep(SESSION_CLEANUP_INTERVAL)
+        try:
+            deleted = get_conn().execute(SQL_DELETE_EXPIRED_SESSIONS).rowcount
+            if deleted:
+                logger.info(f"🧹 {deleted} sesiones expiradas eliminadas")
+        except Exception as e:
+            logger.warning(f"⚠️ Error limpiando sesiones expiradas: {e}")
+
+@auth_bp.record_once
+def init_db_on_register(state):
+    """Inicializar la base de datos y el limpiador de sesiones al registrar el blueprint"""
+    init_db()
+    threading.Thread(target=cleanup_expired_sessions, name='session-cleaner', daemon=True).start()
@@ -0,0 +1,127 @@
+"""
+Conversión offline del modelo Keras a formatos optimizados para inferencia
+
+Uso:
+    python -m backend.convert_model tflite --calibration-dir fotos/
+    python -m backend.convert_model onnx    # requiere tf2onnx; el engine TensorRT
+                                            # se construye en la GPU al cargar el .onnx
+    python -m backend.convert_model savedmodel
+"""
+import argparse
+import glob
+import os
+import tempfile
+import logging
+import numpy as np
+import tensorflow as tf
+import keras
+from tensorflow.keras.models import load_model
+from backend.damage_analyzer import (
+    DEFAULT_MODEL_PATH, IMG_SIZE, SAVEDMODEL_SIGNATURES, _scale_pixels, decode_image
+)
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.webp')
+
+def representative_dataset(calibration_dir, limit=200):
+    """Generador de imágenes reales preprocesadas para calibrar la cuantización,
+    con la misma decodificación y escalado que el servicio"""
+    paths = sorted(
+        path
+        for pattern in CALIBRATION_EXTENSIONS
+        for path in glob.glob(os.path.join(calibration_dir, '**', pattern), recursive=True)
+    )[:limit]
+    if not paths:
+        raise FileNotFoundError(f"No hay imágenes de calibración en: {calibration_dir}")
+    
+    logger.info("🖼️ Calibrando con %d imágenes", len(paths))
+    
+    def generator():
+        for path in paths:
+            yield [_scale_pixels(decode_image(path, IMG_SIZE)[np.newaxis])]
+    
+    return generator
+
+def convert_tflite(model_path, output_path, calibration_dir):
+    """Convertir a TFLite con cuantización INT8 completa (pesos, activaciones y E/S)"""
+    model = load_model(model_path)
+    
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        # Se convierte desde un SavedModel exportado: from_keras_model y
+        # from_concrete_functions fallan con modelos Keras 3 en TF 2.16
+        model.export(saved_model_dir)
+        
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(calibration_dir)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+        tflite_model = converter.convert()
+    
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    logger.info("✅ Modelo TFLite guardado en: %s", output_path)
+
+def convert_onnx(model_path, output_path, opset=17):
+    """Exportar a ONNX con batch dinámico, como entrada para TensorRT"""
+    import tf2onnx
+    
+    model = load_model(model_path)
+    predict_fn = tf.function(lambda x: model(x, training=False))
+    input_signature = (tf.TensorSpec([None, *IMG_SIZE, 3], tf.float32, name='input'),)
+    tf2onnx.convert.from_function(predict_fn, input_signature=input_signature,
+                                  opset=opset, output_path=output_path)
+    logger.info("✅ Modelo ONNX guardado en: %s", output_path)
+
+def convert_savedmodel(model_path, output_dir):
+    """Exportar un SavedModel con una firma de forma fija por tamaño de batch;
+    la entrada son píxeles uint8 y el preprocesado de MobileNetV2 va dentro del grafo"""
+    model = load_model(model_path)
+    rescaling = keras.layers.Rescaling(1.0 / 127.5, offset=-1.0)
+    
+    archive = keras.export.ExportArchive()
+    archive.track(model)
+    for batch_size, name in SAVEDMODEL_SIGNATURES.items():
+        archive.add_endpoint(
+            name,
+            lambda x: model(rescaling(tf.cast(x, tf.float32)), training=False),
+            input_signature=[tf.TensorSpec([batch_size, *IMG_SIZE, 3], tf.uint8, name='input')]
+        )
+    archive.write_out(output_dir)
+    logger.info("✅ SavedModel guardado en: %s", output_dir)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="Modelo Keras de origen")
+    subparsers = parser.add_subparsers(dest='format', required=True)
+    
+    tflite_parser = subparsers.add_parser('tflite', help="TFLite INT8 para CPU (XNNPACK)")
+    tflite_parser.add_argument('--calibration-dir', required=True,
+                               help="Carpeta con fotos reales de vehículos para calibrar")
+    tflite_parser.add_argument('--output', help="Ruta de salida (por defecto junto al modelo)")
+    
+    onnx_parser = subparsers.add_parser('onnx', help="ONNX para TensorRT en GPU NVIDIA")
+    onnx_parser.add_argument('--opset', type=int, default=17)
+    onnx_parser.add_argument('--output', help="Ruta de salida (por defecto junto al modelo)")
+    
+    savedmodel_parser = subparsers.add_parser('savedmodel', help="SavedModel con firmas de forma fija (batch 1 y 4)")
+    savedmodel_parser.add_argument('--output', help="Carpeta de salida (por defecto junto al modelo)")
+    
+    args = parser.parse_args()
+    
+    if args.format == 'tflite':
+        output = args.output or os.path.splitext(args.model)[0] + '.tflite'
+        convert_tflite(args.model, output, args.calibration_dir)
+    elif args.format == 'onnx':
+        output = args.output or os.path.splitext(args.model)[0] + '.onnx'
+        convert_onnx(args.model, output, args.opset)
+    elif args.format == 'savedmodel':
+        output = args.output or os.path.splitext(args.model)[0] + '_savedmodel'
+        convert_savedmodel(args.model, output)
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,177 @@
 """
 Módulo profesional para análisis de daños vehiculares - CORREGIDO
 """
+import io
 import os
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
 import numpy as np
+from PIL import Image
+
+# oneDNN debe activarse antes de importar TensorFlow
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+
+import tensorflow as tf
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Numba es opcional (no está en requirements.txt): sin él, el postprocesado usa NumPy
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Hilos de TensorFlow: intra-op = núcleos, inter-op = 1 (modelo pequeño, un grafo por petición)
+NUM_THREADS = int(os.environ.get('TF_NUM_THREADS', os.cpu_count() or 1))
+try:
+    tf.config.threading.set_intra_op_parallelism_threads(NUM_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(int(os.environ.get('TF_INTER_OP_THREADS', 1)))
+except RuntimeError as e:
+    # El runtime ya estaba inicializado (p. ej. TensorFlow usado antes de importar este módulo)
+    logger.warning("⚠️ No se pudo configurar los hilos de TensorFlow: %s", e)
+
+DEFAULT_MODEL_PATH = "backend/models/best_mobilenet_4classes_improved.keras"
+IMG_SIZE = (224, 224)
+# Firmas del SavedModel exportado con backend/convert_model.py: tamaño de batch fijo -> nombre
+SAVEDMODEL_SIGNATURES = {1: 'serving_default', 4: 'serving_batch4'}
+# Batch float32 reservado una vez para el caso habitual (los 4 ángulos de un vehículo)
+BATCH_BUFFER_SIZE = 4
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+# Compilar el modelo Keras con XLA (fusión de kernels); activar solo si gana en el hardware destino
+USE_XLA = os.environ.get('AUTOSCAN_XLA') == '1'
+
+# Lectura y decodificación de los ángulos en paralelo (PIL libera el GIL al decodificar)
+preprocess_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='preprocess')
+
+def _quantize(x, details):
+    """Convertir la entrada float al tipo entero del tensor según (scale, zero_point)"""
+    scale, zero_point = details['quantization']
+    dtype = details['dtype']
+    if scale == 0:
+        return x.astype(dtype)
+    info = np.iinfo(dtype)
+    return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(dtype)
+
+def _dequantize(q, details):
+    """Convertir la salida entera del tensor a float: scale * (q - zero_point)"""
+    scale, zero_point = details['quantization']
+    if scale == 0:
+        return q.astype(np.float32)
+    return scale * (q.astype(np.float32) - zero_point)
+
+def _to_mixed_precision(model):
+    """Reconstruir el modelo con política mixed_float16 (tensor cores de GPU),
+    manteniendo la entrada y la capa softmax final en float32"""
+    config = model.get_config()
+    for layer in config['layers'][1:-1]:
+        layer['config']['dtype'] = 'mixed_float16'
+    mixed = model.__class__.from_config(config)
+    mixed.set_weights(model.get_weights())
+    return mixed
+
+def _scale_pixels(pixels, out=None):
+    """preprocess_input de MobileNetV2 ((x / 127.5) - 1) sobre píxeles uint8,
+    opcionalmente escribiendo en un buffer float32 ya reservado"""
+    batch = np.multiply(pixels, np.float32(1.0 / 127.5), out=out, dtype=np.float32)
+    batch -= 1.0
+    return batch
+
+def _read_image_bytes(image):
+    """Bytes codificados de una imagen (ruta, bytes o archivo en memoria)"""
+    if isinstance(image, bytes):
+        return image
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, 'rb') as f:
+            return f.read()
+    return image.getvalue()
+
+def decode_image(image, size=IMG_SIZE):
+    """Decodifica y redimensiona una imagen (ruta, bytes o archivo en memoria) a uint8;
+    compartido por el servicio y la calibración de backend/convert_model.py"""
+    if not isinstance(image, (str, os.PathLike)):
+        image = io.BytesIO(_read_image_bytes(image))
+    
+    with Image.open(image) as img:
+        # JPEG: libjpeg decodifica directamente a 1/2, 1/4 o 1/8 del tamaño (escalado DCT)
+        # sin bajar de size, en lugar de decodificar la foto a resolución completa
+        img.draft('RGB', size[::-1])
+        img = img.convert('RGB').resize(size[::-1], Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return np.asarray(img, dtype=np.uint8)
+
+def _cache_key(image):
+    """Clave de la caché de resultados: ruta + mtime + tamaño para archivos,
+    digest del contenido para imágenes en memoria"""
+    if isinstance(image, (str, os.PathLike)):
+        stat = os.stat(image)
+        return (os.fspath(image), stat.st_mtime_ns, stat.st_size)
+    return hashlib.blake2b(_read_image_bytes(image), digest_size=16).digest()
+
+def _postprocess_numpy(predictions):
+    """Clase principal, confianza (%) y porcentajes de cada fila de un batch de predicciones"""
+    percentages = predictions * np.float32(100.0)
+    class_indices = percentages.argmax(axis=1)
+    return class_indices, percentages[np.arange(len(percentages)), class_indices], percentages
+
+if njit is not None:
+    @njit(cache=True)
+    def _postprocess(predictions):
+        """Versión compilada con Numba: argmax y escalado en una sola pasada por fila"""
+        rows, classes = predictions.shape
+        class_indices = np.empty(rows, np.int64)
+        confidences = np.empty(rows, np.float32)
+        percentages = np.empty((rows, classes), np.float32)
+        for i in range(rows):
+            best = 0
+            for k in range(classes):
+                percentages[i, k] = predictions[i, k] * np.float32(100.0)
+                if percentages[i, k] > percentages[i, best]:
+                    best = k
+            class_indices[i] = best
+            confidences[i] = percentages[i, best]
+        return class_indices, confidences, percentages
+else:
+    _postprocess = _postprocess_numpy
+
+@dataclass(frozen=True, slots=True)
+class DamageResult:
+    """Resultado del análisis de una imagen (orjson lo serializa directamente)"""
+    damage: str
+    damage_label: str
+    confidence: float
+    confidence_level: str
+    description: str
+    all_predictions: dict
+    details: str
+    
+    def to_dict(self):
+        """Resultado como diccionario (copia independiente)"""
+        return asdict(self)
+
 class DamageAnalyzer:
     def __init__(self, model_path=None):
         self.model = None
+        self._signatures = None
+        self.interpreter = None
+        self.trt_engine = None
         self.model_loaded = False
+        self._predict = None
+        self._predict_fn = None
+        self._input_lut = None
+        self._raw_input = False
+        self._lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        self._result_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
         
         # Configuración CORREGIDA - igual que tu script de prueba
-        self.IMG_SIZE = (224, 224)
+        self.IMG_SIZE = IMG_SIZE
+        self._batch_buffer = np.empty((BATCH_BUFFER_SIZE, *self.IMG_SIZE, 3), dtype=np.float32)
         self.CLASS_NAMES = {
             0: "01-minor",
             1: "02-moderate", 
@@ -38,101 +193,290 @@ class DamageAnalyzer:
             "04-no-damage": "Vehículo en buen estado sin daños visibles"
         }
         
+        # Tablas precalculadas para construir los resultados
+        self.SHORT_NAMES = {idx: name.split('-', 1)[1] for idx, name in self.CLASS_NAMES.items()}
+        self.CONFIDENCE_THRESHOLDS = np.array([60, 80])
+        self.CONFIDENCE_LEVELS = ("baja", "media", "alta")
+        
         self._load_model(model_path)
     
     def _load_model(self, model_path=None):
         """Carga el modelo de IA"""
         try:
             if model_path is None:
-                model_path = "backend/models/best_mobilenet_4classes_improved.keras"
+                model_path = os.environ.get('MODEL_PATH', DEFAULT_MODEL_PATH)
             
             if not os.path.exists(model_path):
                 # Intentar con formato .h5 si .keras no existe
                 h5_path = model_path.replace('.keras', '.h5')
                 if os.path.exists(h5_path):
                     model_path = h5_path
-                    logger.info(f"🔄 Usando modelo .h5: {h5_path}")
+                    logger.info("🔄 Usando modelo .h5: %s", h5_path)
                 else:
                     raise FileNotFoundError(f"Modelo no encontrado: {model_path}")
             
-            logger.info(f"📦 Cargando modelo desde: {model_path}")
-            self.model = load_model(model_path)
+            logger.info("📦 Cargando modelo desde: %s", model_path)
+            if model_path.endswith('.onnx'):
+                self._load_tensorrt(model_path)
+            elif model_path.endswith('.tflite'):
+                self._load_tflite(model_path)
+            elif os.path.isdir(model_path):
+                self._load_savedmodel(model_path)
+            else:
+                self._load_keras(model_path)
+            self._warmup()
             self.model_loaded = True
             logger.info("✅ Modelo cargado exitosamente")
             
         except Exception as e:
-            logger.error(f"❌ Error cargando el modelo: {e}")
+            logger.error("❌ Error cargando el modelo: %s", e)
             self.model_loaded = False
             raise
     
+    def _load_keras(self, model_path):
+        """Carga el modelo Keras (.keras / .h5)"""
+        self.model = load_model(model_path)
+        
+        # En GPU, FP16 en convoluciones; el .keras guarda el dtype por capa,
+        # así que la política global no basta y hay que reconstruir el modelo
+        if tf.config.list_physical_devices('GPU'):
+            self.model = _to_mixed_precision(self.model)
+            logger.info("⚡ Precisión mixta float16 activada (GPU)")
+        
+        # preprocess_input dentro del grafo: el modelo recibe los píxeles uint8 decodificados
+        wrapped = tf.keras.Sequential([
+            tf.keras.Input((*self.IMG_SIZE, 3)),
+            tf.keras.layers.Rescaling(1.0 / 127.5, offset=-1.0),
+            self.model
+        ])
+        
+        # Función concreta trazada una sola vez: evita la preparación de model.predict en cada llamada
+        self._predict_fn = tf.function(
+            lambda x: wrapped(tf.cast(x, tf.float32), training=False),
+            input_signature=[tf.TensorSpec([None, *self.IMG_SIZE, 3], tf.uint8)],
+            jit_compile=USE_XLA
+        ).get_concrete_function()
+        if USE_XLA:
+            logger.info("⚡ Compilación XLA activada")
+        self._raw_input = True
+        self._predict = self._predict_keras
+    
+    def _load_tflite(self, model_path):
+        """Carga un modelo TFLite (cuantizado INT8 con backend/convert_model.py);
+        el delegado XNNPACK viene activado por defecto en el intérprete"""
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=NUM_THREADS)
+        self.interpreter.allocate_tensors()
+        self._input_details = self.interpreter.get_input_details()[0]
+        self._output_details = self.interpreter.get_output_details()[0]
+        
+        # Entrada cuantizada: tabla píxel uint8 -> valor cuantizado con el preprocesado incluido,
+        # así los píxeles decodificados llegan al intérprete sin pasar por float32
+        if self._input_details['quantization'][0] != 0:
+            self._input_lut = _quantize(_scale_pixels(np.arange(256, dtype=np.uint8)), self._input_details)
+            self._raw_input = True
+        self._predict = self._predict_tflite
+        logger.info("⚡ Intérprete TFLite listo (entrada %s)", self._input_details['dtype'].__name__)
+    
+    def _load_savedmodel(self, model_dir):
+        """Carga un SavedModel con firmas de forma fija (ver SAVEDMODEL_SIGNATURES)"""
+        loaded = tf.saved_model.load(model_dir)
+        self._signatures = {size: loaded.signatures[name] for size, name in SAVEDMODEL_SIGNATURES.items()}
+        self._saved_model = loaded
+        # Los SavedModel con entrada uint8 incluyen el preprocesado en el grafo
+        input_spec = self._signatures[1].structured_input_signature[1]['input']
+        self._raw_input = input_spec.dtype == tf.uint8
+        self._predict = self._predict_savedmodel
+        logger.info("⚡ SavedModel listo (batch %s)", ', '.join(map(str, self._signatures)))
+    
+    def _load_tensorrt(self, onnx_path):
+        """Carga el engine TensorRT; sin TensorRT/CUDA recurre al modelo Keras"""
+        try:
+            from backend.trt_engine import TensorRTEngine
+        except ImportError as e:
+            logger.warning("⚠️ TensorRT/CUDA no disponible (%s), usando el modelo Keras", e)
+            self._load_keras(DEFAULT_MODEL_PATH)
+            return
+        
+        self.trt_engine = TensorRTEngine(onnx_path)
+        self._predict = self._predict_tensorrt
+        logger.info("⚡ Engine TensorRT listo")
+    
+    def _warmup(self):
+        """Primeras inferencias (selección de kernels, autotune) antes de atender peticiones"""
+        start = time.perf_counter()
+        # Píxeles aleatorios (ceros pueden dar caminos atípicos), en el formato de entrada del backend
+        sample = np.random.default_rng(0).integers(0, 256, (4, *self.IMG_SIZE, 3), dtype=np.uint8)
+        if not self._raw_input:
+            sample = _scale_pixels(sample)
+        for _ in range(3):
+            self._predict(sample[:1])
+            _postprocess(self._predict(sample))
+        logger.info("🔥 Modelo precalentado en %.0f ms", (time.perf_counter() - start) * 1000)
+    
+    def _predict_tensorrt(self, batch):
+        """Predicción con TensorRT, en bloques del tamaño máximo del engine"""
+        from backend.trt_engine import MAX_BATCH
+        with self._lock:
+            return np.concatenate([
+                self.trt_engine.predict(batch[i:i + MAX_BATCH])
+                for i in range(0, len(batch), MAX_BATCH)
+            ])
+    
+    def _predict_keras(self, batch):
+        """Predicción con la función concreta del modelo Keras (píxeles uint8)"""
+        return self._predict_fn(tf.constant(batch, dtype=tf.uint8)).numpy()
+    
+    def _predict_savedmodel(self, batch):
+        """Predicción con las firmas de forma fija: batch 1 directo, el resto en bloques
+        rellenados hasta el mayor tamaño exportado"""
+        if len(batch) in self._signatures:
+            return self._signatures[len(batch)](input=tf.constant(batch))['output_0'].numpy()
+        
+        block = max(self._signatures)
+        predictions = []
+        for i in range(0, len(batch), block):
+            chunk = batch[i:i + block]
+            padded = np.zeros((block, *chunk.shape[1:]), dtype=batch.dtype)
+            padded[:len(chunk)] = chunk
+            predictions.append(self._signatures[block](input=tf.constant(padded))['output_0'].numpy()[:len(chunk)])
+        return np.concatenate(predictions)
+    
+    def _predict_tflite(self, batch):
+        """Predicción con el intérprete TFLite, imagen a imagen con la forma fija (1, 224, 224, 3);
+        acepta píxeles uint8 crudos (modelo cuantizado) o el batch float32 preprocesado"""
+        input_index = self._input_details['index']
+        output_index = self._output_details['index']
+        predictions = np.empty((len(batch), self._output_details['shape'][-1]), dtype=np.float32)
+        
+        if batch.dtype == np.uint8:
+            inputs = self._input_lut[batch]
+        else:
+            inputs = _quantize(batch, self._input_details)
+        
+        # El intérprete no es thread-safe: serializar las invocaciones
+        with self._lock:
+            for i in range(len(inputs)):
+                self.interpreter.set_tensor(input_index, inputs[i:i + 1])
+                self.interpreter.invoke()
+                predictions[i] = _dequantize(self.interpreter.get_tensor(output_index), self._output_details)[0]
+        
+        return predictions
+    
+    def _decode_image(self, image):
+        """Decodifica y redimensiona una imagen al tamaño de entrada del modelo"""
+        return decode_image(image, self.IMG_SIZE)
+    
     def preprocess_image(self, image_path):
-        """Preprocesa una imagen para el modelo"""
+        """Preprocesa una imagen para el modelo (ruta o archivo en memoria)"""
         try:
-            img = load_img(image_path, target_size=self.IMG_SIZE)
-            img_array = img_to_array(img)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = preprocess_input(img_array)
-            return img_array
+            return self._preprocess_batch([image_path])
             
         except Exception as e:
-            logger.error(f"Error preprocesando imagen {image_path}: {e}")
+            logger.error("Error preprocesando imagen %s: %s", image_path, e)
             raise
     
+    def _decode_batch(self, images):
+        """Decodifica varias imágenes en un único tensor uint8 (N, 224, 224, 3)"""
+        batch = np.empty((len(images), *self.IMG_SIZE, 3), dtype=np.uint8)
+        for i, array in enumerate(preprocess_executor.map(self._decode_image, images)):
+            batch[i] = array
+        return batch
+    
+    def _preprocess_batch(self, images):
+        """Preprocesa varias imágenes en un único tensor float32 (N, 224, 224, 3)"""
+        return _scale_pixels(self._decode_batch(images))
+    
+    def _rows_to_results(self, predictions):
+        """Construye los resultados de un batch a partir de sus filas de probabilidades"""
+        # Clase principal, confianza y nivel (> 80 alta, > 60 media, resto baja) de todo el batch
+        class_indices, confidences, percentages = _postprocess(np.ascontiguousarray(predictions, dtype=np.float32))
+        levels = np.searchsorted(self.CONFIDENCE_THRESHOLDS, confidences).tolist()
+        confidences = confidences.tolist()
+        
+        results = []
+        for main_class_idx, confidence, level, row in zip(class_indices.tolist(), confidences, levels, percentages.tolist()):
+            main_class = self.CLASS_NAMES[main_class_idx]
+            results.append(DamageResult(
+                damage=self.SHORT_NAMES[main_class_idx],
+                damage_label=self.CLASS_LABELS[main_class],
+                confidence=round(confidence, 2),
+                confidence_level=self.CONFIDENCE_LEVELS[level],
+                description=self.CLASS_DESCRIPTIONS[main_class],
+                all_predictions=dict(zip(self.CLASS_NAMES.values(), row)),
+                details=self._generate_details(main_class, confidence)
+            ))
+            logger.info("📊 %s (%.1f%%)", self.CLASS_LABELS[main_class], confidence)
+        
+        return results
+    
+    def _cache_get(self, key):
+        """Resultado cacheado para key (None si no está)"""
+        with self._cache_lock:
+            result = self._result_cache.get(key)
+            if result is not None:
+                self._result_cache.move_to_end(key)
+            return result
+    
+    def _cache_put(self, key, result):
+        """Guardar un resultado, descartando el menos usado recientemente"""
+        with self._cache_lock:
+            self._result_cache[key] = result
+            self._result_cache.move_to_end(key)
+            if len(self._result_cache) > RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+    
+    def clear_cache(self):
+        """Vaciar la caché de resultados"""
+        with self._cache_lock:
+            self._result_cache.clear()
+    
+    def _predict_images(self, images):
+        """Decodifica, preprocesa y predice un batch de imágenes"""
+        pixels = self._decode_batch(images)
+        
+        # Los modelos con entrada cuantizada reciben directamente los píxeles uint8
+        if self._raw_input:
+            return self._predict(pixels)
+        if len(pixels) > BATCH_BUFFER_SIZE:
+            return self._predict(_scale_pixels(pixels))
+        
+        # El buffer compartido queda reservado hasta que el backend ha copiado la entrada
+        with self._buffer_lock:
+            return self._predict(_scale_pixels(pixels, out=self._batch_buffer[:len(pixels)]))
+    
+    def _analyze_images(self, images):
+        """Resultados de varias imágenes; solo las que no están en caché pasan por el modelo"""
+        keys = [_cache_key(image) for image in images]
+        results = [self._cache_get(key) for key in keys]
+        
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            predictions = self._predict_images([images[i] for i in missing])
+            for i, result in zip(missing, self._rows_to_results(predictions)):
+                results[i] = result
+                self._cache_put(keys[i], result)
+        
+        # all_predictions es un dict mutable: cada llamador recibe su propia copia
+        # para no alterar el resultado guardado en la caché
+        return [replace(result, all_predictions=dict(result.all_predictions)) for result in results]
+    
     def analyze_single_image(self, image_path):
         """Analiza una sola imagen"""
         if not self.model_loaded:
             raise RuntimeError("Modelo no cargado")
         
         try:
-            # Preprocesar
-            processed_img = self.preprocess_image(image_path)
-            
-            # Predecir
-            predictions = self.model.predict(processed_img, verbose=0)
-            prediction_array = predictions[0]
-            
-            # Obtener resultados
-            main_class_idx = np.argmax(prediction_array)
-            main_class = self.CLASS_NAMES[main_class_idx]
-            confidence = float(prediction_array[main_class_idx] * 100)
-            
-            # Todas las probabilidades
-            all_predictions = {}
-            for i, prob in enumerate(prediction_array):
-                class_name = self.CLASS_NAMES[i]
-                all_predictions[class_name] = float(prob * 100)
-            
-            # Nivel de confianza
-            if confidence > 80:
-                confidence_level = "alta"
-            elif confidence > 60:
-                confidence_level = "media" 
-            else:
-                confidence_level = "baja"
-            
-            result = {
-                "damage": main_class.replace("01-", "").replace("02-", "").replace("03-", "").replace("04-", ""),
-                "damage_label": self.CLASS_LABELS[main_class],
-                "confidence": round(confidence, 2),
-                "confidence_level": confidence_level,
-                "description": self.CLASS_DESCRIPTIONS[main_class],
-                "all_predictions": all_predictions,
-                "details": self._generate_details(main_class, confidence)
-            }
-            
-            logger.info(f"📊 {self.CLASS_LABELS[main_class]} ({confidence:.1f}%)")
-            return result
+            return self._analyze_images([image_path])[0]
             
         except Exception as e:
-            logger.error(f"Error analizando {image_path}: {e}")
+            logger.error("Error analizando %s: %s", image_path, e)
             raise
     
     def analyze_vehicle(self, image_paths):
-        """Analiza un vehículo completo con 4 ángulos"""
+        """Analiza un vehículo completo con 4 ángulos en un único batch"""
         if not self.model_loaded:
             raise RuntimeError("Modelo no cargado")
         
-        results = {}
         angle_names = {
             'frontal': 'Vista Frontal',
             'lateral-derecho': 'Lateral Derecho',
@@ -141,10 +485,12 @@ class DamageAnalyzer:
         }
         
         try:
-            # Analizar cada ángulo
-            for angle, image_path in image_paths.items():
-                logger.info(f"🔍 Analizando {angle_names[angle]}...")
-                results[angle] = self.analyze_single_image(image_path)
+            angles = list(image_paths.keys())
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("🔍 Analizando %s...", ', '.join(angle_names[angle] for angle in angles))
+            
+            # Preprocesar los ángulos y predecir con una sola llamada al modelo
+            results = dict(zip(angles, self._analyze_images([image_paths[angle] for angle in angles])))
             
             # Conclusión general
             conclusion = self._generate_general_conclusion(results)
@@ -153,9 +499,13 @@ class DamageAnalyzer:
             return results
             
         except Exception as e:
-            logger.error(f"Error en análisis completo: {e}")
+            logger.error("Error en análisis completo: %s", e)
             raise
     
+    def analyze_vehicle_bytes(self, images):
+        """Analiza un vehículo completo a partir de las imágenes en memoria"""
+        return self.analyze_vehicle(images)
+    
     def _generate_details(self, class_name, confidence):
         """Genera detalles específicos"""
         details_map = {
@@ -178,18 +528,12 @@ class DamageAnalyzer:
     
     def _generate_general_conclusion(self, results):
         """Genera conclusión general"""
-        damage_counts = {"Sin Daño": 0, "Daño Leve": 0, "Daño Moderado": 0, "Daño Severo": 0}
-        total_confidence = 0
-        angle_count = 0
-        
-        for angle, result in results.items():
-            if angle != 'conclusion':
-                damage_label = result['damage_label']
-                damage_counts[damage_label] += 1
-                total_confidence += result['confidence']
-                angle_count += 1
-        
-        avg_confidence = total_confidence / angle_count if angle_count > 0 else 0
+        # results solo contiene los ángulos (la conclusión se añade después)
+        angle_results = list(results.values())
+        counts = Counter(result.damage_label for result in angle_results)
+        damage_counts = {label: counts[label] for label in ("Sin Daño", "Daño Leve", "Daño Moderado", "Daño Severo")}
+        
+        avg_confidence = sum(result.confidence for result in angle_results) / len(angle_results) if angle_results else 0
         
         # Determinar estado general
         if damage_counts["Daño Severo"] > 0:
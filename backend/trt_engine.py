@@ -0,0 +1,103 @@
+"""
+Motor TensorRT para inferencia en GPU NVIDIA a partir del modelo exportado a ONNX
+
+Requiere los paquetes opcionales `tensorrt` y `cuda-python` (no incluidos en
+requirements.txt); si no están instalados, DamageAnalyzer usa el modelo Keras.
+"""
+import os
+import re
+import logging
+import numpy as np
+import tensorrt as trt
+from cuda import cudart
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 4
+INPUT_SHAPE = (224, 224, 3)
+
+_trt_logger = trt.Logger(trt.Logger.WARNING)
+
+def _check(result):
+    """Validar el código de error de una llamada a cudart y devolver su valor"""
+    err, *values = result
+    if err != cudart.cudaError_t.cudaSuccess:
+        raise RuntimeError(f"Error CUDA: {cudart.cudaGetErrorString(err)[1].decode()}")
+    return values[0] if len(values) == 1 else values
+
+def _plan_path(onnx_path):
+    """Ruta del engine serializado, específica de la GPU y la versión de TensorRT"""
+    props = _check(cudart.cudaGetDeviceProperties(0))
+    gpu_name = re.sub(r'[^A-Za-z0-9]+', '-', props.name.decode(errors='ignore').strip('\x00'))
+    return f"{os.path.splitext(onnx_path)[0]}.{gpu_name}.trt{trt.__version__}.plan"
+
+def _build_trt_engine(onnx_path):
+    """Construir el engine TensorRT (FP16 si la GPU lo soporta) desde el ONNX"""
+    builder = trt.Builder(_trt_logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, _trt_logger)
+
+    with open(onnx_path, 'rb') as f:
+        if not parser.parse(f.read()):
+            errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+            raise RuntimeError(f"Error parseando {onnx_path}: {errors}")
+
+    config = builder.create_builder_config()
+    if builder.platform_has_fast_fp16:
+        config.set_flag(trt.BuilderFlag.FP16)
+
+    # Batch dinámico de 1 (una imagen) a MAX_BATCH (los 4 ángulos)
+    input_name = network.get_input(0).name
+    profile = builder.create_optimization_profile()
+    profile.set_shape(input_name, (1, *INPUT_SHAPE), (MAX_BATCH, *INPUT_SHAPE), (MAX_BATCH, *INPUT_SHAPE))
+    config.add_optimization_profile(profile)
+
+    serialized = builder.build_serialized_network(network, config)
+    if serialized is None:
+        raise RuntimeError(f"No se pudo construir el engine TensorRT para {onnx_path}")
+    return bytes(serialized)
+
+class TensorRTEngine:
+    """Ejecuta el modelo con TensorRT, con buffers de GPU reservados para MAX_BATCH"""
+
+    def __init__(self, onnx_path):
+        plan_path = _plan_path(onnx_path)
+        if os.path.exists(plan_path):
+            logger.info("📦 Cargando engine TensorRT: %s", plan_path)
+            with open(plan_path, 'rb') as f:
+                serialized = f.read()
+        else:
+            logger.info("🛠️ Construyendo engine TensorRT desde %s (solo la primera vez)", onnx_path)
+            serialized = _build_trt_engine(onnx_path)
+            with open(plan_path, 'wb') as f:
+                f.write(serialized)
+
+        self.runtime = trt.Runtime(_trt_logger)
+        self.engine = self.runtime.deserialize_cuda_engine(serialized)
+        self.context = self.engine.create_execution_context()
+        self.stream = _check(cudart.cudaStreamCreate())
+
+        names = [self.engine.get_tensor_name(i) for i in range(self.engine.num_io_tensors)]
+        self.input_name = next(n for n in names if self.engine.get_tensor_mode(n) == trt.TensorIOMode.INPUT)
+        self.output_name = next(n for n in names if self.engine.get_tensor_mode(n) == trt.TensorIOMode.OUTPUT)
+        self.num_classes = self.engine.get_tensor_shape(self.output_name)[-1]
+
+        self.d_input = _check(cudart.cudaMalloc(MAX_BATCH * int(np.prod(INPUT_SHAPE)) * 4))
+        self.d_output = _check(cudart.cudaMalloc(MAX_BATCH * self.num_classes * 4))
+        self.context.set_tensor_address(self.input_name, self.d_input)
+        self.context.set_tensor_address(self.output_name, self.d_output)
+
+    def predict(self, batch):
+        """Inferencia de un batch float32 (N, 224, 224, 3) con N <= MAX_BATCH"""
+        host_input = np.ascontiguousarray(batch, dtype=np.float32)
+        host_output = np.empty((len(batch), self.num_classes), dtype=np.float32)
+
+        self.context.set_input_shape(self.input_name, host_input.shape)
+        _check(cudart.cudaMemcpyAsync(self.d_input, host_input.ctypes.data, host_input.nbytes,
+                                      cudart.cudaMemcpyKind.cudaMemcpyHostToDevice, self.stream))
+        if not self.context.execute_async_v3(self.stream):
+            raise RuntimeError("Fallo en la ejecución de TensorRT")
+        _check(cudart.cudaMemcpyAsync(host_output.ctypes.data, self.d_output, host_output.nbytes,
+                                      cudart.cudaMemcpyKind.cudaMemcpyDeviceToHost, self.stream))
+        _check(cudart.cudaStreamSynchronize(self.stream))
+        return host_output
@@ -0,0 +1,6 @@
+"""
+Punto de entrada WSGI de AutoScan IA para gunicorn
+"""
+from app import app
+
+application = app